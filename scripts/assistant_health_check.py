@@ -22,14 +22,13 @@ import argparse
 import subprocess
 import socket
 import tempfile
-import stat
 import shlex
 import json
-import time
 import datetime
 import shutil
 import re
-import textwrap
+import heapq
+import concurrent.futures
 
 # defaults
 DEFAULT_ENV_FILES = [
@@ -41,26 +40,42 @@ EMBED_PORT = 9000
 LANCEDB_PORT = 8001
 MYSQL_PORT = 3306
 
+# queries for query_db_checks; each statement is tagged with a leading label
+# column so its rows can be told apart in the mysql batch output. The cheap
+# aggregates go first so a slow `recent` scan can't cost the counts on timeout.
+DB_CHECKS_STATEMENTS = (
+    "SELECT 'exists', COUNT(*) FROM information_schema.tables WHERE table_schema=DATABASE() AND table_name='llm_token_usage';",
+    "SELECT 'tokens_today', COALESCE(SUM(tokens),0) FROM llm_token_usage WHERE usage_date = CURDATE();",
+    "SELECT 'decision_requests_awaiting', COUNT(*) FROM llm_decision_requests WHERE status='awaiting';",
+    "SELECT 'signals_pending', COUNT(*) FROM llm_signals WHERE status='pending';",
+    "SELECT 'recent', usage_date,component,tokens,note,created_at FROM llm_token_usage ORDER BY created_at DESC LIMIT 10;",
+)
+DB_CHECKS_SQL = ''.join(DB_CHECKS_STATEMENTS)
+# per-statement budget, as when each query ran in its own client call
+DB_STATEMENT_TIMEOUT = 10
+
+
+# KEY=VALUE lines of a .env file; blank lines, comments and lines without '=' never match.
+# [^\S\n] is "whitespace except newline", so keys and values are trimmed like str.strip()
+ENV_LINE_RE = re.compile(r'^(?![^\S\n]*#)[^\S\n]*([^=\n]*?)[^\S\n]*=[^\S\n]*(.*?)[^\S\n]*$', re.M)
+# KEY=VALUE pairs of a systemctl Environment= string (values may be quoted)
+ENVSTR_RE = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)=(\"(?:[^\"\\]|\\.)*\"|'(?:[^\\'\\]|\\.)*'|[^ ]+)")
+# `ps -o %cpu,%mem,cmd` output line
+PS_LINE_RE = re.compile(r"\s*([0-9.]+)\s+([0-9.]+)\s+(.*)")
+
+
+def strip_quotes(v):
+    if len(v) >= 2 and ((v[0] == v[-1] == '"') or (v[0] == v[-1] == "'")):
+        return v[1:-1]
+    return v
+
 
 def load_env_file(path):
-    env = {}
     if not os.path.exists(path):
-        return env
+        return {}
     with open(path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            if '=' not in line:
-                continue
-            k, v = line.split('=', 1)
-            k = k.strip()
-            v = v.strip()
-            # remove surrounding quotes
-            if len(v) >= 2 and ((v[0] == v[-1] == '"') or (v[0] == v[-1] == "'")):
-                v = v[1:-1]
-            env[k] = v
-    return env
+        text = f.read()
+    return {k: strip_quotes(v) for k, v in ENV_LINE_RE.findall(text)}
 
 
 def run_cmd(cmd, timeout=10, capture_output=True):
@@ -105,12 +120,10 @@ def parse_envstr(envstr):
     """Parse systemctl Environment string into dict. Handles quoted values."""
     if not envstr:
         return {}
-    patt = re.findall(r"([A-Za-z_][A-Za-z0-9_]*)=(\"(?:[^\"\\]|\\.)*\"|'(?:[^\\'\\]|\\.)*'|[^ ]+)", envstr)
+    patt = ENVSTR_RE.findall(envstr)
     d = {}
     for k, v in patt:
-        if len(v) >= 2 and ((v[0] == v[-1] == '"') or (v[0] == v[-1] == "'")):
-            v = v[1:-1]
-        d[k] = v
+        d[k] = strip_quotes(v)
     return d
 
 
@@ -124,7 +137,7 @@ def ps_cpu_mem(pid):
         return None
     out = out.strip()
     # split into cpu, mem, command
-    m = re.match(r"\s*([0-9.]+)\s+([0-9.]+)\s+(.*)", out)
+    m = PS_LINE_RE.match(out)
     if not m:
         return None
     return {'cpu_pct': float(m.group(1)), 'mem_pct': float(m.group(2)), 'cmd': m.group(3)}
@@ -134,8 +147,13 @@ def has_mysql_client():
     return shutil.which('mysql') is not None or shutil.which('mariadb') is not None
 
 
-def mysql_exec_query(dbcfg, sql, db=None, timeout=10):
-    """Execute SQL via mysql client using a temporary defaults file. Returns (rc, stdout, stderr)."""
+def mysql_exec_query(dbcfg, sql, db=None, timeout=10, force=False):
+    """Execute SQL via mysql client using a temporary defaults file. Returns (rc, stdout, stderr).
+
+    With force=True the client keeps going after a failing statement, so a
+    multi-statement batch still returns the rows of the statements that worked.
+    On timeout the rows already received are returned with rc 124.
+    """
     exe = shutil.which('mysql') or shutil.which('mariadb')
     if not exe:
         return 127, '', 'mysql client not found'
@@ -153,6 +171,9 @@ def mysql_exec_query(dbcfg, sql, db=None, timeout=10):
             f.write(f"port={dbcfg.get('port')}\n")
     os.chmod(path, 0o600)
     cmd = [exe, f"--defaults-extra-file={path}", '-N', '-B']
+    if force:
+        # --unbuffered flushes after each statement, so finished results survive a timeout kill
+        cmd += ['--force', '--unbuffered']
     if db:
         cmd += ['-D', db]
     cmd += ['-e', sql]
@@ -161,8 +182,10 @@ def mysql_exec_query(dbcfg, sql, db=None, timeout=10):
         out = p.stdout or ''
         err = p.stderr or ''
         return p.returncode, out, err
-    except subprocess.TimeoutExpired:
-        return 124, '', 'timeout'
+    except subprocess.TimeoutExpired as e:
+        # partial output arrives as bytes even in text mode; drop a half-written last line
+        out = (e.stdout or b'').decode('utf-8', errors='replace')
+        return 124, out[:out.rfind('\n') + 1], 'timeout'
     finally:
         try:
             os.remove(path)
@@ -170,84 +193,104 @@ def mysql_exec_query(dbcfg, sql, db=None, timeout=10):
             pass
 
 
-def query_token_table_summary(dbcfg):
-    info = {'available': False}
-    if not has_mysql_client():
-        info['error'] = 'mysql client not available'
-        return info
-    # check table existence
-    db = dbcfg.get('db') or dbcfg.get('database')
-    if not db:
-        info['error'] = 'no database provided'
-        return info
-    sql_exists = "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema=DATABASE() AND table_name='llm_token_usage';"
-    rc, out, err = mysql_exec_query(dbcfg, sql_exists, db=db)
-    if rc != 0:
-        info['error'] = f'mysql error: {err.strip()}'
-        return info
+def parse_tagged_rows(out):
+    """Group batch output rows by their leading tag column: {tag: [[col, ...], ...]}."""
+    rows = {}
+    for line in (out or '').splitlines():
+        parts = line.split('\t')
+        rows.setdefault(parts[0], []).append(parts[1:])
+    return rows
+
+
+def first_int(rows, tag):
     try:
-        exists = int(out.strip().splitlines()[0] or '0')
+        return int(rows[tag][0][0] or '0')
     except Exception:
-        exists = 0
-    info['available'] = bool(exists)
-    if not exists:
-        return info
-    # tokens today
-    sql_sum = "SELECT COALESCE(SUM(tokens),0) FROM llm_token_usage WHERE usage_date = CURDATE();"
-    rc, out, err = mysql_exec_query(dbcfg, sql_sum, db=db)
-    if rc == 0:
-        try:
-            tokens_today = int(out.strip().splitlines()[0] or '0')
-        except Exception:
-            tokens_today = None
-    else:
-        tokens_today = None
-    info['tokens_today'] = tokens_today
-    # last entries
-    sql_last = "SELECT usage_date,component,tokens,note,created_at FROM llm_token_usage ORDER BY created_at DESC LIMIT 10;"
-    rc, out, err = mysql_exec_query(dbcfg, sql_last, db=db)
-    if rc == 0 and out:
-        rows = []
-        for line in out.strip().splitlines():
-            parts = line.split('\t')
-            rows.append(parts)
-        info['recent'] = rows
-    else:
-        info['recent'] = []
-    return info
+        return None
 
 
-def query_queue_counts(dbcfg):
-    info = {'ok': False}
-    if not has_mysql_client():
-        info['error'] = 'mysql client not available'
-        return info
+def query_db_checks(dbcfg):
+    """Token table summary and queue counts over a single mysql client session.
+
+    The DB port is TCP-probed first; when that fails the client is not started,
+    so an unreachable server fails fast instead of waiting out the client
+    timeout. Returns (port_reachable, token_info, queue_info).
+    """
+    host = dbcfg.get('host') or '127.0.0.1'
+    port_reachable = tcp_connect(host, int(dbcfg.get('port') or MYSQL_PORT), timeout=1)
+    token_info = {'available': False}
+    queue_info = {'ok': False}
     db = dbcfg.get('db') or dbcfg.get('database')
-    if not db:
-        info['error'] = 'no database provided'
-        return info
-    # awaiting decision requests
-    sql1 = "SELECT COUNT(*) FROM llm_decision_requests WHERE status='awaiting';"
-    rc, out, err = mysql_exec_query(dbcfg, sql1, db=db)
-    if rc == 0:
-        try:
-            info['decision_requests_awaiting'] = int(out.strip().splitlines()[0] or '0')
-        except Exception:
-            info['decision_requests_awaiting'] = None
-    else:
-        info['decision_requests_awaiting'] = None
-    # pending signals
-    sql2 = "SELECT COUNT(*) FROM llm_signals WHERE status='pending';"
-    rc, out, err = mysql_exec_query(dbcfg, sql2, db=db)
-    if rc == 0:
-        try:
-            info['signals_pending'] = int(out.strip().splitlines()[0] or '0')
-        except Exception:
-            info['signals_pending'] = None
+    error = None
+    if not has_mysql_client():
+        error = 'mysql client not available'
+    elif not db:
+        error = 'no database provided'
+    elif not port_reachable and host != 'localhost':
+        # the mysql client talks to 'localhost' over the unix socket, so a failed TCP probe doesn't rule it out
+        error = 'mysql server not reachable'
+    if error:
+        token_info['error'] = error
+        queue_info['error'] = error
+        return port_reachable, token_info, queue_info
+    # all statements go through one client invocation (one connection)
+    rc, out, err = mysql_exec_query(dbcfg, DB_CHECKS_SQL, db=db, force=True,
+                                    timeout=DB_STATEMENT_TIMEOUT * len(DB_CHECKS_STATEMENTS))
+    rows = parse_tagged_rows(out)
+
+    # token table: existence, tokens today, last entries
+    if 'exists' not in rows:
+        token_info['error'] = f'mysql error: {err.strip()}'
     else:
-        info['signals_pending'] = None
-    info['ok'] = True
-    return info
+        exists = first_int(rows, 'exists') or 0
+        token_info['available'] = bool(exists)
+        if exists:
+            token_info['tokens_today'] = first_int(rows, 'tokens_today')
+            token_info['recent'] = rows.get('recent', [])
+
+    # queues: awaiting decision requests, pending signals
+    queue_info['decision_requests_awaiting'] = first_int(rows, 'decision_requests_awaiting')
+    queue_info['signals_pending'] = first_int(rows, 'signals_pending')
+    queue_info['ok'] = True
+    return port_reachable, token_info, queue_info
+
+
+def read_tail(path, chars=20000):
+    """Return the last `chars` characters of a UTF-8 text file, reading backwards from the end.
+
+    Undecodable bytes are dropped (errors='ignore') and yield no characters, so
+    the byte window is doubled until more than `chars` characters decode or the
+    start of the file is reached; the result equals reading the whole file and
+    slicing.
+    """
+    size = chars * 4
+    try:
+        with open(path, 'rb') as fh:
+            end = fh.seek(0, os.SEEK_END)
+            while True:
+                start = max(0, end - size)
+                fh.seek(start)
+                text = fh.read(end - start).decode('utf-8', errors='ignore')
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+                # one extra character keeps a character cut at the window edge out of the result
+                if start == 0 or len(text) > chars:
+                    break
+                size *= 2
+    except Exception:
+        return None
+    return text[-chars:]
+
+
+def iter_log_files(log_dir):
+    """Yield (mtime, path) for regular files in log_dir, streaming from os.scandir."""
+    with os.scandir(log_dir) as it:
+        for entry in it:
+            try:
+                if entry.is_file():
+                    yield entry.stat().st_mtime, entry.path
+            except OSError:
+                # vanished or unreadable entry; skip it rather than abort the scan
+                continue
 
 
 def scan_logs_for_errors(log_dir, patterns=None):
@@ -257,22 +300,24 @@ def scan_logs_for_errors(log_dir, patterns=None):
         return findings
     # search recent logs (last 10 files by mtime)
     try:
-        files = sorted([os.path.join(log_dir, f) for f in os.listdir(log_dir)], key=lambda p: os.path.getmtime(p), reverse=True)[:10]
+        # top-10 selection; no need to sort every file in the directory
+        recent = heapq.nlargest(10, iter_log_files(log_dir), key=lambda e: e[0])
     except Exception:
         return findings
+    files = [path for _, path in recent]
     for f in files:
-        try:
-            with open(f, 'r', encoding='utf-8', errors='ignore') as fh:
-                tail = fh.read()[-20000:]
-        except Exception:
+        tail = read_tail(f)
+        if tail is None:
             continue
         for pat in patterns:
-            if pat in tail:
-                # include a short snippet around first match
-                idx = tail.find(pat)
-                start = max(0, idx - 200)
-                snippet = tail[start: start + 800]
-                findings.append({'file': f, 'pattern': pat, 'snippet': snippet})
+            # one search gives both the hit and the snippet position
+            idx = tail.find(pat)
+            if idx < 0:
+                continue
+            # include a short snippet around first match
+            start = max(0, idx - 200)
+            snippet = tail[start: start + 800]
+            findings.append({'file': f, 'pattern': pat, 'snippet': snippet})
     return findings
 
 
@@ -464,6 +509,12 @@ def main():
         'db': args.db_name or env.get('DB_NAME') or None,
     }
 
+    # DB checks (MySQL port probe + mysql client) start now so they overlap
+    # with the local systemctl/port/process probes below
+    db_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    db_future = db_pool.submit(query_db_checks, dbcfg)
+    db_pool.shutdown(wait=False)
+
     result = {
         'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
         'gateway': {},
@@ -491,11 +542,18 @@ def main():
         envpairs = parse_envstr(envstr)
         result['gateway']['env'] = {k: ('<redacted>' if 'KEY' in k or 'PASSWORD' in k or 'TOKEN' in k else v) for k, v in envpairs.items()}
 
-    # 2) TCP ports
-    result['ports']['gateway_18789'] = tcp_connect('127.0.0.1', GATEWAY_PORT, timeout=1)
-    result['ports']['embed_9000'] = tcp_connect('127.0.0.1', EMBED_PORT, timeout=1)
-    result['ports']['lancedb_8001'] = tcp_connect('127.0.0.1', LANCEDB_PORT, timeout=1)
-    result['ports']['mysql_3306'] = tcp_connect(dbcfg.get('host') or '127.0.0.1', int(dbcfg.get('port') or MYSQL_PORT), timeout=1)
+    # 2) TCP ports, probed concurrently so unreachable ports don't add up their timeouts;
+    # the MySQL port is probed by the DB worker and filled in at step 5
+    port_targets = {
+        'gateway_18789': ('127.0.0.1', GATEWAY_PORT),
+        'embed_9000': ('127.0.0.1', EMBED_PORT),
+        'lancedb_8001': ('127.0.0.1', LANCEDB_PORT),
+    }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(port_targets)) as pool:
+        port_futures = {name: pool.submit(tcp_connect, host, port, timeout=1) for name, (host, port) in port_targets.items()}
+    for name, fut in port_futures.items():
+        result['ports'][name] = fut.result()
+    result['ports']['mysql_3306'] = None
 
     # best-effort: detect if a node process binds 2070 (historical)
     try:
@@ -529,11 +587,11 @@ def main():
         result['process']['loadavg'] = None
 
     # 5) DB token summary
-    token_info = query_token_table_summary(dbcfg)
+    mysql_port_ok, token_info, queue_info = db_future.result()
+    result['ports']['mysql_3306'] = mysql_port_ok
     result['db']['token_table'] = token_info
 
     # 6) queue counts
-    queue_info = query_queue_counts(dbcfg)
     result['queues'] = queue_info
 
     # 7) token budget evaluation